@@ -1,10 +1,20 @@
 import config
 import telebot
 from telebot import types
-from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from telebot.apihelper import ApiTelegramException
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, MessageEntity
 from datetime import datetime
 import sqlite3
+import random
+import re
+import threading
+import time
+import queue
 import logging
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from html.parser import HTMLParser
 from typing import List, Tuple, Optional
 
 # Configure logging
@@ -14,50 +24,404 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-bot = telebot.TeleBot(config.API_TOKEN)
+# Handler worker threads; the database read pool is sized to match
+WORKER_THREADS = 8
+
+bot = telebot.TeleBot(config.API_TOKEN, threaded=True, num_threads=WORKER_THREADS)
+
+
+class RateLimitedBot:
+    """Wrap a TeleBot and throttle outbound messages to Telegram's rate limits"""
+    
+    # (messages, seconds) windows: 30 msg/s overall, and per chat 1 msg/s on
+    # average with bursts of up to 3 so a reply plus a movie card do not wait
+    GLOBAL_LIMIT = (30, 1.0)
+    CHAT_LIMIT = (3, 3.0)
+    MAX_RETRIES = 3
+    
+    def __init__(self, bot: telebot.TeleBot):
+        self._bot = bot
+        self._lock = threading.Lock()
+        self._global_sent = deque()
+        self._chat_sent = {}
+        self._last_sweep = time.monotonic()
+    
+    def __getattr__(self, name):
+        # Everything that is not a chat message goes straight to the bot
+        return getattr(self._bot, name)
+    
+    def _acquire(self, chat_id: int):
+        """Block until both the global and the per-chat window have room"""
+        global_count, global_window = self.GLOBAL_LIMIT
+        chat_count, chat_window = self.CHAT_LIMIT
+        
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now - self._last_sweep >= chat_window:
+                    self._sweep_idle_chats(now - chat_window)
+                    self._last_sweep = now
+                
+                chat_sent = self._chat_sent.setdefault(chat_id, deque())
+                while self._global_sent and self._global_sent[0] <= now - global_window:
+                    self._global_sent.popleft()
+                while chat_sent and chat_sent[0] <= now - chat_window:
+                    chat_sent.popleft()
+                
+                if len(self._global_sent) < global_count and len(chat_sent) < chat_count:
+                    self._global_sent.append(now)
+                    chat_sent.append(now)
+                    return
+                
+                wait = 0.0
+                if len(self._global_sent) >= global_count:
+                    wait = self._global_sent[0] + global_window - now
+                if len(chat_sent) >= chat_count:
+                    wait = max(wait, chat_sent[0] + chat_window - now)
+            time.sleep(wait)
+    
+    def _sweep_idle_chats(self, cutoff: float):
+        """Forget chats whose last message is older than the per-chat window"""
+        idle = [chat_id for chat_id, sent in self._chat_sent.items() if not sent or sent[-1] <= cutoff]
+        for chat_id in idle:
+            del self._chat_sent[chat_id]
+    
+    def _call(self, chat_id: int, method, /, *args, **kwargs):
+        """Send through the rate limiter, retrying when Telegram answers 429"""
+        # chat_id and method are positional-only so a chat_id keyword
+        # in kwargs is passed through to method untouched
+        for attempt in range(self.MAX_RETRIES + 1):
+            self._acquire(chat_id)
+            try:
+                return method(*args, **kwargs)
+            except ApiTelegramException as e:
+                if e.error_code != 429 or attempt == self.MAX_RETRIES:
+                    raise
+                retry_after = e.result_json.get('parameters', {}).get('retry_after', 1)
+                logger.warning(f"Rate limited in chat {chat_id}, retrying in {retry_after}s")
+                time.sleep(retry_after)
+    
+    def send_message(self, chat_id: int, text: str, **kwargs):
+        return self._call(chat_id, self._bot.send_message, chat_id, text, **kwargs)
+    
+    def send_photo(self, chat_id: int, photo, **kwargs):
+        return self._call(chat_id, self._bot.send_photo, chat_id, photo, **kwargs)
+    
+    def reply_to(self, message, text: str, **kwargs):
+        return self._call(message.chat.id, self._bot.reply_to, message, text, **kwargs)
+    
+    def edit_message_text(self, text: str, chat_id: int, **kwargs):
+        return self._call(chat_id, self._bot.edit_message_text, text, chat_id=chat_id, **kwargs)
+
+
+rate_bot = RateLimitedBot(bot)
 
 # Database configuration
 DB_NAME = "movie_database.db"
+# User data lives in its own file so the shipped movie database never holds it
+FAVORITES_DB_NAME = "favorites.db"
+
+# Actual genres from the database
+GENRES = [
+    "Action", "Adventure", "Animation", "Biography", "Comedy", 
+    "Crime", "Drama", "Family", "Fantasy", "Film-Noir",
+    "History", "Horror", "Music", "Musical", "Mystery",
+    "Romance", "Sci-Fi", "Sport", "Thriller", "War", "Western"
+]
+
+# Size of the precomputed top lists kept in memory
+TOP_N = 10
+
+# Star strings for every whole rating 0-10, indexed by int(rating)
+STARS = tuple("⭐" * i for i in range(11))
+SEP = "   ━━━━━━━━━━━━━━━━━━━\n"
+
+# Telegram's maximum photo caption length
+CAPTION_LIMIT = 1024
+
+
+@dataclass(frozen=True)
+class Movie:
+    """A single row of the movies table"""
+    __slots__ = ('id', 'img', 'title', 'year', 'genre', 'rating', 'overview')
+    
+    id: int
+    img: str
+    title: str
+    year: int
+    genre: str
+    rating: float
+    overview: str
+
+
+def _movie_row(cursor: sqlite3.Cursor, row: tuple) -> Movie:
+    """sqlite3 row factory building Movie objects from movies table rows"""
+    return Movie(*row)
 
 
 class DatabaseManager:
     """Handle all database operations with proper connection management"""
     
-    def __init__(self, db_name: str):
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA cache_size=-20000",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA mmap_size=268435456",
+    )
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS user_data.favorites (
+            user_id INTEGER NOT NULL,
+            movie_id INTEGER NOT NULL,
+            ts TEXT NOT NULL,
+            PRIMARY KEY (user_id, movie_id)
+        )""",
+    )
+    INDEXES = (
+        "CREATE INDEX IF NOT EXISTS idx_movies_title_nocase ON movies(title COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_movies_rating ON movies(rating DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_movies_year ON movies(year)",
+    )
+    FAVORITES_BATCH_SIZE = 50
+    FAVORITES_FLUSH_INTERVAL = 0.1  # seconds
+    
+    # journal_mode is persisted in the file, so readers only need the cache settings
+    READ_PRAGMAS = (
+        "PRAGMA cache_size=-20000",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA mmap_size=268435456",
+    )
+    
+    def __init__(self, db_name: str, pool_size: int = 4,
+                 favorites_db_name: str = FAVORITES_DB_NAME):
         self.db_name = db_name
+        # Single read-write connection, kept for writes
+        self._conn = sqlite3.connect(db_name, check_same_thread=False, isolation_level=None)
+        for pragma in self.PRAGMAS:
+            self._conn.execute(pragma)
+        # Favorites are kept in a separate, untracked database file
+        self._conn.execute("ATTACH DATABASE ? AS user_data", (favorites_db_name,))
+        self._conn.execute("PRAGMA user_data.journal_mode=WAL")
+        for statement in self.SCHEMA + self.INDEXES:
+            self._conn.execute(statement)
+        self._has_search_index = self._create_search_index()
+        self._lock = threading.Lock()
+        
+        # Favorites are written in batches by a single background thread
+        self._favorites = queue.Queue()
+        self._favorites_writer = threading.Thread(
+            target=self._write_favorites, name="favorites-writer", daemon=True
+        )
+        self._favorites_writer.start()
+        
+        # Pool of read-only connections so handler threads can read in parallel
+        self._pool = queue.Queue()
+        for _ in range(pool_size):
+            conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True, check_same_thread=False)
+            for pragma in self.READ_PRAGMAS:
+                conn.execute(pragma)
+            self._pool.put(conn)
+        self._pool_size = pool_size
+        self._max_movie_id = None
+        self._load_top_indexes()
+    
+    def _create_search_index(self) -> bool:
+        """Create and fill the FTS5 title index if the database lacks one"""
+        try:
+            exists = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'movies_fts'"
+            ).fetchone()
+            if not exists:
+                self._conn.execute(
+                    "CREATE VIRTUAL TABLE movies_fts USING fts5("
+                    "title, overview, content='movies', content_rowid='id')"
+                )
+                self._conn.execute("INSERT INTO movies_fts(movies_fts) VALUES('rebuild')")
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"Full-text search unavailable, using exact title search: {e}")
+            return False
+    
+    def _load_top_indexes(self):
+        """Read the movies table once and precompute the default top lists"""
+        query = """
+            SELECT id, img, title, year, genre, rating, overview
+            FROM movies
+            WHERE rating IS NOT NULL
+            ORDER BY rating DESC
+        """
+        movies = self.execute_query(query, row_factory=_movie_row)
+        
+        by_genre = {genre: [] for genre in GENRES}
+        by_year = {}
+        for movie in movies:
+            # Same matching as the SQL filter: genre LIKE '%name%'
+            movie_genre = movie.genre.lower()
+            for genre, top in by_genre.items():
+                if len(top) < TOP_N and genre.lower() in movie_genre:
+                    top.append(movie)
+            top = by_year.setdefault(movie.year, [])
+            if len(top) < TOP_N:
+                top.append(movie)
+        
+        self._all_by_rating = tuple(movies[:TOP_N])
+        self._top_by_genre = {genre: tuple(top) for genre, top in by_genre.items()}
+        self._top_by_year = {year: tuple(top) for year, top in by_year.items()}
     
-    def execute_query(self, query: str, params: tuple = ()) -> List[Tuple]:
-        """Execute a query and return results"""
+    def _fetch(self, query: str, params: tuple = (), row_factory=None) -> List:
+        """Run a read query on a pooled connection, raising sqlite3.Error on failure"""
+        conn = self._pool.get()
         try:
-            with sqlite3.connect(self.db_name) as conn:
-                cursor = conn.cursor()
-                cursor.execute(query, params)
-                results = cursor.fetchall()
-                return results
+            cursor = conn.cursor()
+            cursor.row_factory = row_factory
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        finally:
+            self._pool.put(conn)
+    
+    def execute_query(self, query: str, params: tuple = (), row_factory=None) -> List:
+        """Execute a read query on a pooled connection and return results"""
+        try:
+            return self._fetch(query, params, row_factory)
         except sqlite3.Error as e:
             logger.error(f"Database error: {e}")
             return []
     
-    def get_random_movie(self) -> Optional[Tuple]:
+    def execute_write(self, query: str, rows: List[tuple]) -> bool:
+        """Execute a write query for every row in one transaction on the read-write connection"""
+        try:
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._conn.executemany(query, rows)
+                    self._conn.execute("COMMIT")
+                except sqlite3.Error:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Database error: {e}")
+            return False
+    
+    def add_favorite(self, user_id: int, movie_id: int):
+        """Queue a favorite to be saved by the background writer"""
+        self._favorites.put((user_id, movie_id, datetime.now().isoformat(timespec='seconds')))
+    
+    def _write_favorites(self):
+        """Persist queued favorites, one transaction per batch"""
+        while True:
+            item = self._favorites.get()
+            if item is None:
+                return
+            
+            # Collect whatever else arrives within the flush interval
+            batch = [item]
+            deadline = time.monotonic() + self.FAVORITES_FLUSH_INTERVAL
+            while len(batch) < self.FAVORITES_BATCH_SIZE:
+                try:
+                    item = self._favorites.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._flush_favorites(batch)
+                    return
+                batch.append(item)
+            
+            self._flush_favorites(batch)
+    
+    def _flush_favorites(self, batch: List[Tuple[int, int, str]]):
+        """Insert a batch of favorites in a single transaction"""
+        query = "INSERT OR IGNORE INTO user_data.favorites (user_id, movie_id, ts) VALUES (?, ?, ?)"
+        if not self.execute_write(query, batch):
+            logger.error(f"Failed to save {len(batch)} favorites")
+    
+    def close(self):
+        """Close all pooled connections and the read-write connection"""
+        # Let the writer flush pending favorites first
+        self._favorites.put(None)
+        self._favorites_writer.join()
+        
+        for _ in range(self._pool_size):
+            self._pool.get().close()
+        with self._lock:
+            self._conn.close()
+    
+    def get_random_movie(self) -> Optional[Movie]:
         """Get a random movie from database"""
-        query = "SELECT * FROM movies ORDER BY RANDOM() LIMIT 1"
-        results = self.execute_query(query)
+        # Probe the primary key index instead of sorting the whole table
+        if self._max_movie_id is None:
+            results = self.execute_query("SELECT MAX(id) FROM movies")
+            self._max_movie_id = results[0][0] if results else None
+        if not self._max_movie_id:
+            return None
+        
+        query = "SELECT * FROM movies WHERE id >= ? ORDER BY id LIMIT 1"
+        results = self.execute_query(
+            query, (random.randint(1, self._max_movie_id),), row_factory=_movie_row
+        )
         return results[0] if results else None
     
-    def search_movie_by_title(self, title: str) -> Optional[Tuple]:
+    def search_movie_by_title(self, title: str) -> Optional[Movie]:
         """Search for a movie by title (SQL injection safe)"""
-        query = "SELECT * FROM movies WHERE LOWER(title) = LOWER(?)"
-        results = self.execute_query(query, (title,))
+        try:
+            return self._search_movie_by_title(title.lower())
+        except sqlite3.Error as e:
+            logger.error(f"Database error: {e}")
+            return None
+    
+    # The cached helpers below let sqlite3.Error propagate, so a failed
+    # query is never stored in the cache as an empty result
+    @lru_cache(maxsize=2048)
+    def _search_movie_by_title(self, title: str) -> Optional[Movie]:
+        """Cached title lookup, keyed on the lowercased title"""
+        query = "SELECT * FROM movies WHERE title = ? COLLATE NOCASE LIMIT 1"
+        results = self._fetch(query, (title,), row_factory=_movie_row)
+        if results or not self._has_search_index:
+            return results[0] if results else None
+        
+        # No exact match: prefix-match every word of the title, best ranked first
+        words = re.findall(r'\w+', title)
+        if not words:
+            return None
+        match = " ".join(f'"{word}"*' for word in words)
+        query = """
+            SELECT m.* FROM movies_fts f
+            JOIN movies m ON m.id = f.rowid
+            WHERE f.title MATCH ?
+            ORDER BY rank
+            LIMIT 1
+        """
+        results = self._fetch(query, (match,), row_factory=_movie_row)
         return results[0] if results else None
     
     def get_top_movies(self, limit: int = 10, order_by: str = 'rating', 
-                       genre: Optional[str] = None, year: Optional[int] = None) -> List[Tuple]:
+                       genre: Optional[str] = None, year: Optional[int] = None,
+                       year_lt: Optional[int] = None) -> Tuple[Movie, ...]:
         """Get top movies with optional filters"""
         # Validate order_by to prevent SQL injection
         valid_columns = ['rating', 'year', 'title']
         if order_by not in valid_columns:
             order_by = 'rating'
         
+        # Default rating lists are answered from memory without touching SQLite
+        if order_by == 'rating' and limit <= TOP_N and not year_lt:
+            if genre and not year and genre in self._top_by_genre:
+                return self._top_by_genre[genre][:limit]
+            if year and not genre:
+                return self._top_by_year.get(year, ())[:limit]
+            if not genre and not year:
+                return self._all_by_rating[:limit]
+        
+        try:
+            return self._get_top_movies(limit, order_by, genre, year, year_lt)
+        except sqlite3.Error as e:
+            logger.error(f"Database error: {e}")
+            return ()
+    
+    @lru_cache(maxsize=512)
+    def _get_top_movies(self, limit: int, order_by: str, genre: Optional[str],
+                        year: Optional[int], year_lt: Optional[int]) -> Tuple[Movie, ...]:
+        """Cached top movies query, keyed on the positional filter values"""
         query = """
             SELECT id, img, title, year, genre, rating, overview
             FROM movies
@@ -73,44 +437,56 @@ class DatabaseManager:
             query += " AND year = ?"
             params.append(year)
         
+        if year_lt:
+            query += " AND year < ?"
+            params.append(year_lt)
+        
         query += f" ORDER BY {order_by} DESC LIMIT ?"
         params.append(limit)
         
-        return self.execute_query(query, tuple(params))
+        return tuple(self._fetch(query, tuple(params), row_factory=_movie_row))
 
 
-db_manager = DatabaseManager(DB_NAME)
+db_manager = DatabaseManager(DB_NAME, pool_size=WORKER_THREADS)
 
 
-def send_movie_info(chat_id: int, movie_data: Tuple):
+def send_movie_info(chat_id: int, movie: Movie):
     """Send formatted movie information to user"""
     try:
-        movie_id, img_url, title, year, genre, rating, overview = movie_data
-        
         info_text = f"""
-📍 <b>Title:</b> {title}
-📍 <b>Year:</b> {year}
-📍 <b>Genre:</b> {genre}
-📍 <b>IMDB Rating:</b> ⭐ {rating}/10
+📍 <b>Title:</b> {movie.title}
+📍 <b>Year:</b> {movie.year}
+📍 <b>Genre:</b> {movie.genre}
+📍 <b>IMDB Rating:</b> ⭐ {movie.rating}/10
 
 🔻🔻🔻🔻🔻🔻🔻🔻🔻🔻🔻
-{overview}
+{movie.overview}
 """
         
-        # Send poster if available
-        if img_url:
+        markup = create_favorite_button(movie.id)
+        
+        # Send poster with the info as its caption when it fits, in one request
+        if movie.img and len(info_text) <= CAPTION_LIMIT:
             try:
-                bot.send_photo(chat_id, img_url)
+                rate_bot.send_photo(
+                    chat_id, movie.img,
+                    caption=info_text, parse_mode='HTML', reply_markup=markup
+                )
+                return
+            except Exception as e:
+                logger.warning(f"Failed to send poster: {e}")
+        elif movie.img:
+            try:
+                rate_bot.send_photo(chat_id, movie.img)
             except Exception as e:
                 logger.warning(f"Failed to send poster: {e}")
         
         # Send movie info with favorite button
-        markup = create_favorite_button(movie_id)
-        bot.send_message(chat_id, info_text, parse_mode='HTML', reply_markup=markup)
+        rate_bot.send_message(chat_id, info_text, parse_mode='HTML', reply_markup=markup)
         
     except Exception as e:
         logger.error(f"Error sending movie info: {e}")
-        bot.send_message(chat_id, "❌ Error displaying movie information")
+        rate_bot.send_message(chat_id, "❌ Error displaying movie information")
 
 
 def create_favorite_button(movie_id: int) -> InlineKeyboardMarkup:
@@ -123,7 +499,7 @@ def create_favorite_button(movie_id: int) -> InlineKeyboardMarkup:
     return markup
 
 
-def create_main_keyboard() -> ReplyKeyboardMarkup:
+def _build_main_keyboard() -> ReplyKeyboardMarkup:
     """Create main reply keyboard"""
     markup = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
     markup.add(
@@ -136,12 +512,62 @@ def create_main_keyboard() -> ReplyKeyboardMarkup:
     return markup
 
 
-# ==================== COMMAND HANDLERS ====================
+def _build_help_keyboard() -> InlineKeyboardMarkup:
+    """Create inline keyboard for the help menu"""
+    markup = InlineKeyboardMarkup(row_width=2)
+    
+    buttons = [
+        InlineKeyboardButton("🏆 Top Rated", callback_data='help_top_rated'),
+        InlineKeyboardButton("🎭 By Genre", callback_data='help_genre'),
+        InlineKeyboardButton("📅 By Year", callback_data='help_year'),
+        InlineKeyboardButton("🎲 Random", callback_data='help_random')
+    ]
+    markup.add(*buttons)
+    return markup
 
-@bot.message_handler(commands=['start'])
-def handle_start(message):
-    """Handle /start command"""
-    welcome_text = """
+
+def _build_genre_keyboard() -> InlineKeyboardMarkup:
+    """Create inline keyboard with one button per genre"""
+    markup = InlineKeyboardMarkup(row_width=2)
+    
+    buttons = [
+        InlineKeyboardButton(genre, callback_data=f'top_genre_{genre}')
+        for genre in GENRES
+    ]
+    
+    # Add buttons in rows of 2
+    for i in range(0, len(buttons), 2):
+        markup.add(*buttons[i:i+2])
+    return markup
+
+
+def _build_year_keyboard() -> InlineKeyboardMarkup:
+    """Create inline keyboard with recent years and a classic movies option"""
+    # Database contains movies from 1920-2020
+    # Show recent years (2000-2020) for better UX
+    markup = InlineKeyboardMarkup(row_width=3)
+    
+    buttons = [
+        InlineKeyboardButton(str(year), callback_data=f'top_year_{year}')
+        for year in range(2020, 1999, -1)  # 2020 down to 2000
+    ]
+    
+    # Add buttons in rows of 3
+    for i in range(0, len(buttons), 3):
+        markup.add(*buttons[i:i+3])
+    
+    # Add a button for older movies
+    markup.add(InlineKeyboardButton("🎞️ Classic Movies (1920-1999)", callback_data='top_year_classic'))
+    return markup
+
+
+# Static keyboards and texts, built once at import
+MAIN_KEYBOARD = _build_main_keyboard()
+HELP_KEYBOARD = _build_help_keyboard()
+GENRE_KEYBOARD = _build_genre_keyboard()
+YEAR_KEYBOARD = _build_year_keyboard()
+
+WELCOME_TEXT = """
 🎬 <b>Welcome to the Ultimate Movie Bot!</b> 🎥
 
 Explore our collection of 1,000+ amazing movies!
@@ -153,28 +579,8 @@ Explore our collection of 1,000+ amazing movies!
 
 Enjoy your movie journey! 🍿
 """
-    bot.send_message(
-        message.chat.id,
-        welcome_text,
-        parse_mode='HTML',
-        reply_markup=create_main_keyboard()
-    )
-
 
-@bot.message_handler(commands=['help'])
-def handle_help(message):
-    """Handle /help command"""
-    markup = InlineKeyboardMarkup(row_width=2)
-    
-    buttons = [
-        InlineKeyboardButton("🏆 Top Rated", callback_data='help_top_rated'),
-        InlineKeyboardButton("🎭 By Genre", callback_data='help_genre'),
-        InlineKeyboardButton("📅 By Year", callback_data='help_year'),
-        InlineKeyboardButton("🎲 Random", callback_data='help_random')
-    ]
-    markup.add(*buttons)
-    
-    help_text = """
+HELP_TEXT = """
 ℹ️ <b>AVAILABLE COMMANDS</b>
 
 📋 <b>Main Commands:</b>
@@ -190,12 +596,112 @@ Just type any movie title to search!
 
 Choose an option below or use the keyboard buttons:
 """
+
+
+class _EntityParser(HTMLParser):
+    """Split simple Telegram HTML into plain text and message entities"""
+    
+    TAGS = {
+        'b': 'bold', 'strong': 'bold',
+        'i': 'italic', 'em': 'italic',
+        'u': 'underline', 's': 'strikethrough',
+        'code': 'code',
+    }
     
-    bot.send_message(
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.entities = []
+        self._offset = 0
+        self._open = []
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in self.TAGS:
+            self._open.append((tag, self._offset))
+    
+    def handle_endtag(self, tag):
+        for i in range(len(self._open) - 1, -1, -1):
+            if self._open[i][0] == tag:
+                _, start = self._open.pop(i)
+                if self._offset > start:
+                    self.entities.append(MessageEntity(self.TAGS[tag], start, self._offset - start))
+                break
+    
+    def handle_data(self, data):
+        self.parts.append(data)
+        # Telegram measures entity offsets in UTF-16 code units
+        self._offset += len(data.encode('utf-16-le')) // 2
+
+
+def _html_to_entities(html: str) -> Tuple[str, List[MessageEntity]]:
+    """Parse HTML once into (plain_text, entities) for sending without parse_mode"""
+    parser = _EntityParser()
+    # Telegram trims surrounding whitespace, so strip it before measuring offsets
+    parser.feed(html.strip())
+    parser.close()
+    entities = sorted(parser.entities, key=lambda entity: entity.offset)
+    return "".join(parser.parts), entities
+
+
+WELCOME_PLAIN, WELCOME_ENTITIES = _html_to_entities(WELCOME_TEXT)
+HELP_PLAIN, HELP_ENTITIES = _html_to_entities(HELP_TEXT)
+
+
+def _iter_top_rows(movies: Tuple[Movie, ...], show_year: bool, show_genre: bool,
+                   detailed: bool):
+    """Yield the HTML fragment for each movie of a top list"""
+    if detailed:
+        rating_label, genre_label = "<b>Rating:</b>", "<b>Genre:</b>"
+    else:
+        rating_label, genre_label = "Rating:", "Genre:"
+    
+    for index, movie in enumerate(movies, 1):
+        year = f" ({movie.year})" if show_year else ""
+        genre = f"   🎭 {genre_label} {movie.genre or 'Unknown'}\n" if show_genre else ""
+        
+        short_desc = ""
+        if detailed and movie.overview:
+            # Truncate overview
+            overview = movie.overview
+            short_desc = (overview[:100] + '...') if len(overview) > 100 else overview
+            short_desc = f"   📝 {short_desc}\n"
+        
+        yield (
+            f"\n<b>{index}. {movie.title}</b>{year}\n"
+            f"   ⭐ {rating_label} {movie.rating}/10 {STARS[min(int(movie.rating), 10)]}\n"
+            f"{genre}{short_desc}"
+        )
+
+
+@lru_cache(maxsize=256)
+def _render_top_list(header: str, movies: Tuple[Movie, ...], show_year: bool = True,
+                     show_genre: bool = True, detailed: bool = False) -> str:
+    """Render a numbered top movies list as HTML, memoized per result set"""
+    rows = _iter_top_rows(movies, show_year, show_genre, detailed)
+    return f"{header}\n\n{SEP.join(rows)}{SEP}"
+
+
+# ==================== COMMAND HANDLERS ====================
+
+@bot.message_handler(commands=['start'])
+def handle_start(message):
+    """Handle /start command"""
+    rate_bot.send_message(
         message.chat.id,
-        help_text,
-        parse_mode='HTML',
-        reply_markup=markup
+        WELCOME_PLAIN,
+        entities=WELCOME_ENTITIES,
+        reply_markup=MAIN_KEYBOARD
+    )
+
+
+@bot.message_handler(commands=['help'])
+def handle_help(message):
+    """Handle /help command"""
+    rate_bot.send_message(
+        message.chat.id,
+        HELP_PLAIN,
+        entities=HELP_ENTITIES,
+        reply_markup=HELP_KEYBOARD
     )
 
 
@@ -207,7 +713,7 @@ def handle_random(message):
     if movie:
         send_movie_info(message.chat.id, movie)
     else:
-        bot.send_message(message.chat.id, "❌ No movies found in database")
+        rate_bot.send_message(message.chat.id, "❌ No movies found in database")
 
 
 @bot.message_handler(commands=['top_movies'])
@@ -217,31 +723,14 @@ def handle_top_movies(message):
         movies = db_manager.get_top_movies(limit=10)
         
         if not movies:
-            bot.reply_to(message, "🎬 No movies found in database")
+            rate_bot.reply_to(message, "🎬 No movies found in database")
             return
         
-        response = "🏆 <b>TOP 10 MOVIES BY RATING</b> 🎬\n\n"
-        
-        for index, movie_data in enumerate(movies, 1):
-            _, _, title, year, genre, rating, overview = movie_data
-            
-            # Create star rating
-            stars = "⭐" * int(rating)
-            
-            # Truncate overview
-            short_desc = (overview[:100] + '...') if overview and len(overview) > 100 else (overview or "")
-            
-            response += f"""
-<b>{index}. {title}</b> ({year})
-   ⭐ <b>Rating:</b> {rating}/10 {stars}
-   🎭 <b>Genre:</b> {genre or 'Unknown'}
-"""
-            if short_desc:
-                response += f"   📝 {short_desc}\n"
-            
-            response += "   ━━━━━━━━━━━━━━━━━━━\n"
+        response = _render_top_list(
+            "🏆 <b>TOP 10 MOVIES BY RATING</b> 🎬", movies, detailed=True
+        )
         
-        bot.send_message(
+        rate_bot.send_message(
             message.chat.id,
             response,
             parse_mode='HTML',
@@ -250,78 +739,38 @@ def handle_top_movies(message):
         
     except Exception as e:
         logger.error(f"Error in top_movies: {e}")
-        bot.reply_to(message, f"❌ An error occurred: {str(e)}")
+        rate_bot.reply_to(message, f"❌ An error occurred: {str(e)}")
 
 
 @bot.message_handler(commands=['top_movies_genre'])
 def handle_top_movies_by_genre(message):
     """Handle /top_movies_genre command"""
-    markup = InlineKeyboardMarkup(row_width=2)
-    
-    # Actual genres from the database
-    genres = [
-        "Action", "Adventure", "Animation", "Biography", "Comedy", 
-        "Crime", "Drama", "Family", "Fantasy", "Film-Noir",
-        "History", "Horror", "Music", "Musical", "Mystery",
-        "Romance", "Sci-Fi", "Sport", "Thriller", "War", "Western"
-    ]
-    
-    buttons = [
-        InlineKeyboardButton(genre, callback_data=f'top_genre_{genre}')
-        for genre in genres
-    ]
-    
-    # Add buttons in rows of 2
-    for i in range(0, len(buttons), 2):
-        if i + 1 < len(buttons):
-            markup.add(buttons[i], buttons[i+1])
-        else:
-            markup.add(buttons[i])
-    
-    bot.send_message(
+    rate_bot.send_message(
         message.chat.id,
         "🎭 <b>Select a genre to view top movies:</b>",
         parse_mode='HTML',
-        reply_markup=markup
+        reply_markup=GENRE_KEYBOARD
     )
 
 
 @bot.message_handler(commands=['top_movies_year'])
 def handle_top_movies_by_year(message):
     """Handle /top_movies_year command"""
-    # Database contains movies from 1920-2020
-    # Show recent years (2000-2020) for better UX
-    markup = InlineKeyboardMarkup(row_width=3)
-    
-    buttons = [
-        InlineKeyboardButton(str(year), callback_data=f'top_year_{year}')
-        for year in range(2020, 1999, -1)  # 2020 down to 2000
-    ]
-    
-    # Add buttons in rows of 3
-    for i in range(0, len(buttons), 3):
-        markup.add(*buttons[i:i+3])
-    
-    # Add a button for older movies
-    markup.add(InlineKeyboardButton("🎞️ Classic Movies (1920-1999)", callback_data='top_year_classic'))
-    
-    bot.send_message(
+    rate_bot.send_message(
         message.chat.id,
         "📅 <b>Select a year to view top movies:</b>",
         parse_mode='HTML',
-        reply_markup=markup
+        reply_markup=YEAR_KEYBOARD
     )
 
 
 # ==================== CALLBACK HANDLERS ====================
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('favorite_'))
-def handle_favorite_callback(call):
+def handle_favorite_callback(call, movie_id: str):
     """Handle favorite button clicks"""
     try:
-        movie_id = call.data.split('_')[1]
-        # Here you would typically save to a favorites table
-        bot.answer_callback_query(
+        db_manager.add_favorite(call.from_user.id, int(movie_id))
+        rate_bot.answer_callback_query(
             call.id,
             "⭐ Added to favorites!",
             show_alert=True
@@ -329,138 +778,95 @@ def handle_favorite_callback(call):
         logger.info(f"User {call.from_user.id} favorited movie {movie_id}")
     except Exception as e:
         logger.error(f"Error handling favorite: {e}")
-        bot.answer_callback_query(call.id, "❌ Error adding to favorites")
+        rate_bot.answer_callback_query(call.id, "❌ Error adding to favorites")
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('top_genre_'))
-def handle_genre_callback(call):
+def handle_genre_callback(call, genre: str):
     """Handle genre selection callback"""
     try:
-        genre = call.data.replace('top_genre_', '')
         movies = db_manager.get_top_movies(limit=10, genre=genre)
         
         if not movies:
-            bot.answer_callback_query(
+            rate_bot.answer_callback_query(
                 call.id,
                 f"❌ No movies found in genre '{genre}'",
                 show_alert=True
             )
             return
         
-        response = f"🎭 <b>TOP 10 MOVIES - {genre.upper()}</b> 🎬\n\n"
-        
-        for index, movie_data in enumerate(movies, 1):
-            _, _, title, year, genre_name, rating, _ = movie_data
-            stars = "⭐" * int(rating)
-            
-            response += f"""
-<b>{index}. {title}</b> ({year})
-   ⭐ Rating: {rating}/10 {stars}
-   ━━━━━━━━━━━━━━━━━━━
-"""
+        response = _render_top_list(
+            f"🎭 <b>TOP 10 MOVIES - {genre.upper()}</b> 🎬", movies, show_genre=False
+        )
         
-        bot.edit_message_text(
+        rate_bot.edit_message_text(
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
             text=response,
             parse_mode='HTML'
         )
-        bot.answer_callback_query(call.id)
+        rate_bot.answer_callback_query(call.id)
         
     except Exception as e:
         logger.error(f"Error in genre callback: {e}")
-        bot.answer_callback_query(call.id, f"❌ Error: {str(e)}")
+        rate_bot.answer_callback_query(call.id, f"❌ Error: {str(e)}")
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('top_year_'))
-def handle_year_callback(call):
+def handle_year_callback(call, year: str):
     """Handle year selection callback"""
     try:
         # Handle classic movies option
-        if call.data == 'top_year_classic':
+        if year == 'classic':
             # Show top classic movies (before 2000)
-            query = """
-                SELECT id, img, title, year, genre, rating, overview
-                FROM movies
-                WHERE year < 2000 AND rating IS NOT NULL
-                ORDER BY rating DESC
-                LIMIT 10
-            """
-            conn = sqlite3.connect(DB_NAME)
-            cursor = conn.cursor()
-            cursor.execute(query)
-            movies = cursor.fetchall()
-            conn.close()
+            movies = db_manager.get_top_movies(limit=10, year_lt=2000)
             
             if not movies:
-                bot.answer_callback_query(call.id, "❌ No classic movies found", show_alert=True)
+                rate_bot.answer_callback_query(call.id, "❌ No classic movies found", show_alert=True)
                 return
             
-            response = "🎞️ <b>TOP 10 CLASSIC MOVIES (1920-1999)</b> 🎬\n\n"
-            
-            for index, movie_data in enumerate(movies, 1):
-                _, _, title, year, genre, rating, _ = movie_data
-                stars = "⭐" * int(rating)
-                
-                response += f"""
-<b>{index}. {title}</b> ({year})
-   ⭐ Rating: {rating}/10 {stars}
-   🎭 Genre: {genre or 'Unknown'}
-   ━━━━━━━━━━━━━━━━━━━
-"""
+            response = _render_top_list(
+                "🎞️ <b>TOP 10 CLASSIC MOVIES (1920-1999)</b> 🎬", movies
+            )
             
-            bot.edit_message_text(
+            rate_bot.edit_message_text(
                 chat_id=call.message.chat.id,
                 message_id=call.message.message_id,
                 text=response,
                 parse_mode='HTML'
             )
-            bot.answer_callback_query(call.id)
+            rate_bot.answer_callback_query(call.id)
             return
         
         # Handle specific year
-        year = int(call.data.replace('top_year_', ''))
+        year = int(year)
         movies = db_manager.get_top_movies(limit=10, year=year)
         
         if not movies:
-            bot.answer_callback_query(
+            rate_bot.answer_callback_query(
                 call.id,
                 f"❌ No movies found for year {year}",
                 show_alert=True
             )
             return
         
-        response = f"📅 <b>TOP 10 MOVIES - {year}</b> 🎬\n\n"
-        
-        for index, movie_data in enumerate(movies, 1):
-            _, _, title, _, genre, rating, _ = movie_data
-            stars = "⭐" * int(rating)
-            
-            response += f"""
-<b>{index}. {title}</b>
-   ⭐ Rating: {rating}/10 {stars}
-   🎭 Genre: {genre or 'Unknown'}
-   ━━━━━━━━━━━━━━━━━━━
-"""
+        response = _render_top_list(
+            f"📅 <b>TOP 10 MOVIES - {year}</b> 🎬", movies, show_year=False
+        )
         
-        bot.edit_message_text(
+        rate_bot.edit_message_text(
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
             text=response,
             parse_mode='HTML'
         )
-        bot.answer_callback_query(call.id)
+        rate_bot.answer_callback_query(call.id)
         
     except Exception as e:
         logger.error(f"Error in year callback: {e}")
-        bot.answer_callback_query(call.id, f"❌ Error: {str(e)}")
+        rate_bot.answer_callback_query(call.id, f"❌ Error: {str(e)}")
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('help_'))
-def handle_help_callbacks(call):
+def handle_help_callbacks(call, action: str):
     """Handle help menu callbacks"""
-    action = call.data.replace('help_', '')
-    
     if action == 'random':
         handle_random(call.message)
     elif action == 'top_rated':
@@ -470,39 +876,61 @@ def handle_help_callbacks(call):
     elif action == 'year':
         handle_top_movies_by_year(call.message)
     
-    bot.answer_callback_query(call.id)
+    rate_bot.answer_callback_query(call.id)
 
 
-# ==================== TEXT HANDLERS ====================
+def handle_top_callback(call, arg: str):
+    """Dispatch top_genre_* and top_year_* callbacks"""
+    kind, _, value = arg.partition('_')
+    handler = TOP_CALLBACK_HANDLERS.get(kind)
+    
+    if handler:
+        handler(call, value)
+    else:
+        rate_bot.answer_callback_query(call.id)
 
-@bot.message_handler(func=lambda message: message.text in ['🎲 Random Movie', '/random'])
-def handle_random_button(message):
-    """Handle random movie button"""
-    handle_random(message)
 
+CALLBACK_HANDLERS = {
+    'favorite': handle_favorite_callback,
+    'top': handle_top_callback,
+    'help': handle_help_callbacks,
+}
 
-@bot.message_handler(func=lambda message: message.text == '🏆 Top Movies')
-def handle_top_button(message):
-    """Handle top movies button"""
-    handle_top_movies(message)
+TOP_CALLBACK_HANDLERS = {
+    'genre': handle_genre_callback,
+    'year': handle_year_callback,
+}
 
 
-@bot.message_handler(func=lambda message: message.text == '🎭 By Genre')
-def handle_genre_button(message):
-    """Handle genre button"""
-    handle_top_movies_by_genre(message)
+@bot.callback_query_handler(func=lambda call: True)
+def handle_callback(call):
+    """Route callback queries by the prefix of their data"""
+    prefix, _, arg = call.data.partition('_')
+    handler = CALLBACK_HANDLERS.get(prefix)
+    
+    if handler:
+        handler(call, arg)
+    else:
+        rate_bot.answer_callback_query(call.id)
 
 
-@bot.message_handler(func=lambda message: message.text == '📅 By Year')
-def handle_year_button(message):
-    """Handle year button"""
-    handle_top_movies_by_year(message)
+# ==================== TEXT HANDLERS ====================
+
+# Reply keyboard button texts and the handlers they trigger
+BUTTONS = {
+    '🎲 Random Movie': handle_random,
+    '/random': handle_random,
+    '🏆 Top Movies': handle_top_movies,
+    '🎭 By Genre': handle_top_movies_by_genre,
+    '📅 By Year': handle_top_movies_by_year,
+    'ℹ️ Help': handle_help,
+}
 
 
-@bot.message_handler(func=lambda message: message.text == 'ℹ️ Help')
-def handle_help_button(message):
-    """Handle help button"""
-    handle_help(message)
+@bot.message_handler(func=lambda message: message.text in BUTTONS)
+def handle_button(message):
+    """Handle keyboard buttons with a single lookup"""
+    BUTTONS[message.text](message)
 
 
 @bot.message_handler(func=lambda message: True)
@@ -512,10 +940,10 @@ def handle_text_search(message):
         movie = db_manager.search_movie_by_title(message.text)
         
         if movie:
-            bot.send_message(message.chat.id, "✅ Found it! Here's the movie:")
+            rate_bot.send_message(message.chat.id, "✅ Found it! Here's the movie:")
             send_movie_info(message.chat.id, movie)
         else:
-            bot.send_message(
+            rate_bot.send_message(
                 message.chat.id,
                 f"❌ Sorry, I couldn't find '{message.text}' in the database.\n\n"
                 "Try:\n• Checking the spelling\n• Using /random for a random movie\n"
@@ -523,7 +951,7 @@ def handle_text_search(message):
             )
     except Exception as e:
         logger.error(f"Error in text search: {e}")
-        bot.send_message(message.chat.id, "❌ An error occurred during search")
+        rate_bot.send_message(message.chat.id, "❌ An error occurred during search")
 
 
 # ==================== MAIN ====================
@@ -531,6 +959,13 @@ def handle_text_search(message):
 if __name__ == '__main__':
     logger.info("Bot started successfully!")
     try:
-        bot.infinity_polling()
+        bot.infinity_polling(
+            skip_pending=True,
+            timeout=30,
+            long_polling_timeout=30,
+            allowed_updates=['message', 'callback_query']
+        )
     except Exception as e:
-        logger.error(f"Bot stopped with error: {e}")
\ No newline at end of file
+        logger.error(f"Bot stopped with error: {e}")
+    finally:
+        db_manager.close()
\ No newline at end of file
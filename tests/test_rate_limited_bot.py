@@ -0,0 +1,101 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+bot_main = None
+_workdir = None
+_cwd = None
+
+
+def setUpModule():
+    """Import bot_main against a scratch copy of the database"""
+    global bot_main, _workdir, _cwd
+    _cwd = os.getcwd()
+    _workdir = tempfile.mkdtemp()
+    shutil.copy(os.path.join(ROOT, "movie_database.db"), _workdir)
+    os.chdir(_workdir)
+    import bot_main as module
+    bot_main = module
+
+
+def tearDownModule():
+    bot_main.db_manager.close()
+    os.chdir(_cwd)
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+class FakeBot:
+    """Record the calls RateLimitedBot forwards to the underlying bot"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return name
+        return method
+
+
+class RateLimitedBotTest(unittest.TestCase):
+    """Call each wrapper the way the handlers do"""
+
+    def setUp(self):
+        self.fake = FakeBot()
+        self.rate_bot = bot_main.RateLimitedBot(self.fake)
+        self.rate_bot.CHAT_LIMIT = (1000, 1.0)
+        self.rate_bot.GLOBAL_LIMIT = (1000, 1.0)
+
+    def test_send_message(self):
+        result = self.rate_bot.send_message(
+            42, "text", parse_mode='HTML', reply_markup="markup", disable_web_page_preview=True
+        )
+        self.assertEqual(result, "send_message")
+        self.assertEqual(self.fake.calls, [(
+            "send_message", (42, "text"),
+            {'parse_mode': 'HTML', 'reply_markup': "markup", 'disable_web_page_preview': True},
+        )])
+
+    def test_send_message_with_entities(self):
+        self.rate_bot.send_message(42, "text", entities=["entity"], reply_markup="markup")
+        self.assertEqual(self.fake.calls, [(
+            "send_message", (42, "text"), {'entities': ["entity"], 'reply_markup': "markup"},
+        )])
+
+    def test_send_photo(self):
+        self.rate_bot.send_photo(42, "url", caption="info", parse_mode='HTML', reply_markup="markup")
+        self.assertEqual(self.fake.calls, [(
+            "send_photo", (42, "url"),
+            {'caption': "info", 'parse_mode': 'HTML', 'reply_markup': "markup"},
+        )])
+
+    def test_reply_to(self):
+        message = SimpleNamespace(chat=SimpleNamespace(id=42))
+        self.rate_bot.reply_to(message, "text")
+        self.assertEqual(self.fake.calls, [("reply_to", (message, "text"), {})])
+
+    def test_edit_message_text(self):
+        result = self.rate_bot.edit_message_text(
+            chat_id=42, message_id=7, text="text", parse_mode='HTML'
+        )
+        self.assertEqual(result, "edit_message_text")
+        self.assertEqual(self.fake.calls, [(
+            "edit_message_text", ("text",),
+            {'chat_id': 42, 'message_id': 7, 'parse_mode': 'HTML'},
+        )])
+
+    def test_other_methods_pass_through(self):
+        self.rate_bot.answer_callback_query("call", "done", show_alert=True)
+        self.assertEqual(self.fake.calls, [
+            ("answer_callback_query", ("call", "done"), {'show_alert': True}),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()